@@ -27,7 +27,7 @@ parser = argparse.ArgumentParser(description=desc, epilog=epi,
                                  formatter_class=CustomFormatter)
 parser.add_argument('--test', type=str, nargs='+', default='lambda',
                     choices = ['lambda', 'kwargs', 'mem', 'time', 'error', 'pool',
-                               'poolv', 'all'],
+                               'poolv', 'array', 'all'],
                     help='Test(s) to perform')
 parser.add_argument('--tmp-dir', type=str, default=tmp_dir,
                     help='Temporary file directory')
@@ -92,6 +92,13 @@ def main(args):
         p = sgepy.Pool(tmp_dir=args.tmp_dir, kwargs=kwargs, pkgs=pkgs, n_jobs=2, verbose=True)
         ret = p.map(func1, [1,2,3])
         assert ret == [4, 8, 12], 'poolv test failed'
+    if 'array' in args.test or 'all' in args.test:
+        logging.info('-- array job pool test --')
+        kwargs = {'y' : 2, 'z' : 2}
+        pkgs = ['time']
+        p = sgepy.Pool(tmp_dir=args.tmp_dir, kwargs=kwargs, pkgs=pkgs, n_jobs=2, verbose=True)
+        ret = p.map_array(func1, [1,2,3])
+        assert ret == [4, 8, 12], 'array test failed'
 
     
 if __name__ == '__main__':
@@ -7,7 +7,6 @@ import codecs
 # dependencies
 install_reqs = [
     'dill>=0.3',
-    'pathos>=0.2.8',
     'tqdm>=4'
 ]
 
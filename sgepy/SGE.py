@@ -5,18 +5,344 @@ import sys
 import re
 import time
 import uuid
+import base64
+import random
 import types
+import struct
+import pickle
 import shutil
+import atexit
+import getpass
 import logging
 import functools
+import threading
+import concurrent.futures
 import subprocess as sp
 from distutils.spawn import find_executable
+from multiprocessing.pool import ThreadPool
 ## 3rd party
-import pathos.multiprocessing as mp
-import dill as pickle
+import dill
 import tqdm
 
+# job time resource: seconds or HH:MM:SS
+_INT_RE = re.compile(r'^[0-9]+$')
+_HMS_RE = re.compile(r'^[0-9]{2,}:[0-5][0-9]:[0-5][0-9]$')
+# qsub job id
+_QSUB_JOBID = re.compile(rb'Your job(?:-array)? ([0-9]+)')
+# qstat job table row: jobid, state
+_QSTAT_ROW = re.compile(rb'^\s*(\d+)\s+\S+\s+\S+\s+\S+\s+(\S+)', re.M)
+# qacct job (task) exit status
+_QACCT_EXIT = re.compile(rb'^exit_status\s+(\d+)', re.M)
+
+# tmp dirs that could not be removed right away (removed at exit)
+_pending_cleanup = []
+# background tmp dir removal (created on first use)
+_CLEANUP_POOL = None
+_CLEANUP_LOCK = threading.Lock()
+
+# functions
+def _rmtree_flat(path):
+    """
+    Remove a job tmp dir, which only contains files (no recursive stat calls)
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
+
+def _rmtree_robust(path, verbose=False):
+    """
+    Remove a job tmp dir; if that fails, retry at exit
+    """
+    try:
+        _rmtree_flat(path)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        # eg., NFS silly-renamed files
+        _pending_cleanup.append(path)
+        return None
+    if verbose:
+        logging.info('tmp dir removed: {}'.format(path))
+
+def _cleanup_pool():
+    """
+    Get the thread pool used for removing tmp dirs in the background
+    """
+    global _CLEANUP_POOL
+    with _CLEANUP_LOCK:
+        if _CLEANUP_POOL is None:
+            _CLEANUP_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        return _CLEANUP_POOL
+
+def _drain_pending_cleanup():
+    """
+    Wait for all background tmp dir removals, then remove all tmp dirs
+    that could not be removed while the jobs were running
+    """
+    if _CLEANUP_POOL is not None:
+        _CLEANUP_POOL.shutdown(wait=True)
+    while _pending_cleanup:
+        x = _pending_cleanup.pop()
+        try:
+            shutil.rmtree(x)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logging.warning('Could not remove tmp dir: {}'.format(x))
+atexit.register(_drain_pending_cleanup)
+
+def _dumps(obj):
+    """
+    Serialize with pickle; dill is only used for objects that pickle cannot handle
+    or that reference __main__ (pickle stores these by reference, which the job's
+    __main__ lacks, while dill stores them by value)
+    """
+    try:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        data = None
+    if data is None or b'__main__' in data:
+        data = dill.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return data
+
+def _load_buffers(infile):
+    """
+    Read the out-of-band pickle buffers written by the job script.
+    Format: n_buffers, n x buffer size (uint64), then the raw buffers.
+    """
+    with open(infile, 'rb') as inF:
+        data = bytearray(os.fstat(inF.fileno()).st_size)
+        inF.readinto(data)
+    data = memoryview(data)
+    n = struct.unpack_from('<Q', data, 0)[0]
+    offset = 8 * (n + 1)
+    buffers = []
+    for size in struct.unpack_from('<{}Q'.format(n), data, 8):
+        buffers.append(data[offset:offset + size])
+        offset += size
+    return buffers
+
+def _load(infile):
+    """
+    Deserialize a pickle (or dill) file with a single read.
+    Out-of-band buffers (pickle protocol 5) are read from `infile`.buf, if present.
+    """
+    with open(infile, 'rb') as inF:
+        data = inF.read()
+    try:
+        buffers = _load_buffers(infile + '.buf')
+    except FileNotFoundError:
+        buffers = None
+    if buffers is not None:
+        return pickle.loads(data, buffers=buffers)
+    try:
+        return pickle.loads(data)
+    except Exception:
+        return dill.loads(data)
+
+@functools.lru_cache(maxsize=64)
+def _fmt_time(x):
+    """
+    Format a time resource (seconds or HH:MM:SS) as HH:MM:SS
+    """
+    if _INT_RE.match(x):
+        x = int(x)
+        hours = int(x / 3600)
+        minutes = int((x - (hours * 3600)) / 60)
+        secs = x - (hours * 3600 + minutes * 60)
+        x = '{:0>2}:{:0>2}:{:0>2}'.format(hours, minutes, secs)
+    if not _HMS_RE.match(x):
+        raise ValueError('Time resource not formatted correctly: {}'.format(x))
+    return x
+
+def _time_seconds(x):
+    """
+    Convert a time resource (seconds or HH:MM:SS) to seconds
+    """
+    hours, minutes, secs = _fmt_time(str(x)).split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(secs)
+
+@functools.lru_cache(maxsize=1)
+def _check_sge_tools():
+    """
+    Checking that SGE commands exist (only done once per process)
+    """
+    for exe in ['qsub', 'qstat', 'qacct', 'qdel']:
+        if find_executable(exe) is None:
+            raise OSError('Cannot find command: {}'.format(exe))
+    return True
+
+def _parse_qstat(output):
+    """
+    Parse (bytes) qstat output into a {jobid : state} dict
+    """
+    return dict(_QSTAT_ROW.findall(output))
+
+def _qstat_status(state):
+    """
+    Convert a qstat job state to 'running', 'failed', or None (not found)
+    """
+    if state is None:
+        return None
+    elif state in [b'Eqw', b'd']:
+        return 'failed'
+    else:
+        return 'running'
+
+def _qdel(jobid, verbose=False):
+    """
+    Delete the job from the queue
+    """
+    if verbose:
+        logging.info('qdel: {}'.format(jobid))
+    p = sp.run(['qdel', str(jobid)], stdout=sp.DEVNULL, stderr=sp.PIPE)
+    if p.returncode != 0:
+        logging.warning('Could not delete job {}: {}'.format(jobid, p.stderr.decode().strip()))
+
 # classes
+class QStatPoller(threading.Thread):
+    """
+    Background thread that calls qstat once per poll interval for all jobs
+    of a Pool, so that Workers do not each need to call qstat
+    """
+    def __init__(self, interval=None, verbose=False):
+        """
+        Args:
+          interval : seconds between qstat calls (default: $SGE_POLL_INTERVAL or 30)
+          verbose : verbose output
+        """
+        super().__init__(daemon=True)
+        if interval is None:
+            interval = os.environ.get('SGE_POLL_INTERVAL', 30)
+        self.interval = float(interval)
+        self.verbose = verbose
+        self._jobids = {}       # jobid : registration time
+        self._states = None
+        self._poll_time = None  # start time of the last qstat call
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def wait(self, timeout):
+        """
+        Sleep for `timeout` seconds, returning early if the poller is stopped
+        """
+        self._stop_event.wait(timeout)
+
+    def register(self, jobid):
+        with self._lock:
+            if self.stopped:
+                raise RuntimeError('qstat poller stopped; not registering job {}'.format(jobid))
+            # first job; poll now instead of at the end of the current interval
+            if len(self._jobids) == 0:
+                self._wake.set()
+            self._jobids[jobid] = time.monotonic()
+
+    def unregister(self, jobid):
+        with self._lock:
+            self._jobids.pop(jobid, None)
+
+    def get(self, jobid):
+        """
+        Get the last known qstat state of the job (None if not found).
+        Jobs registered after the last qstat call are assumed to be queued ('qw').
+        Raises RuntimeError once the poller is stopped.
+        """
+        with self._lock:
+            if self.stopped:
+                raise RuntimeError('qstat poller stopped; no longer checking job {}'.format(jobid))
+            registered = self._jobids.get(jobid)
+            if registered is not None and (self._poll_time is None or
+                                           self._poll_time < registered):
+                return b'qw'
+            if self._states is None:
+                return None
+            return self._states.get(jobid.encode())
+
+    def poll(self):
+        """
+        Run qstat for all of the user's jobs & update the job state table
+        """
+        if self.verbose:
+            logging.info('qstat poll: {} jobs'.format(len(self._jobids)))
+        poll_time = time.monotonic()
+        p = sp.run(['qstat', '-u', getpass.getuser()], stdout=sp.PIPE, stderr=sp.PIPE)
+        if p.returncode != 0:
+            # keep the previous snapshot; retry at the next interval
+            logging.warning('qstat failed: {}'.format(p.stderr.decode().strip()))
+            return None
+        states = _parse_qstat(p.stdout)
+        with self._lock:
+            self._states = states
+            self._poll_time = poll_time
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wake.clear()
+            with self._lock:
+                n_jobs = len(self._jobids)
+            if n_jobs > 0:
+                # a failed poll (eg., OSError) must not kill the thread
+                try:
+                    self.poll()
+                except Exception as e:
+                    logging.warning('qstat poll failed: {}'.format(e))
+            self._wake.wait(self.interval)
+
+    def stop(self):
+        """
+        Stop polling. Returns the jobids that were still registered.
+        """
+        with self._lock:
+            self._stop_event.set()
+            jobids = list(self._jobids)
+        self._wake.set()
+        self.join()
+        return jobids
+
+class TransportQueue():
+    """
+    Rate limiter for job submissions to the SGE qmaster: at most `max_inflight`
+    concurrent qsub calls, started at least `min_interval` seconds apart
+    """
+    def __init__(self, min_interval=0.2, max_inflight=4):
+        """
+        Args:
+          min_interval : min time between qsub calls (seconds)
+          max_inflight : max number of concurrent qsub calls
+        """
+        self.min_interval = min_interval
+        self._semaphore = threading.Semaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._last = 0.0
+
+    def acquire(self):
+        self._semaphore.acquire()
+        with self._lock:
+            wait = self._last + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last = time.monotonic()
+
+    def release(self):
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+        
 class Proto():
     """
     Parent class for Worker and Pool
@@ -24,8 +350,11 @@ class Proto():
     def __init__(self, kwargs=dict(), pkgs=[],
                  parallel_env='parallel', threads=1, time='00:59:00',
                  mem=6, gpu=0, conda_env='snakemake', max_attempts=3,
+                 escalation_factor=1.5,
                  tmp_dir='/ebio/abt3_projects/temp_data/', keep_tmp=False,
-                 verbose=False):
+                 poll_base=2, poll_factor=3, poll_cap=120,
+                 retry_base=2, retry_factor=3, retry_cap=120,
+                 payload_inline_threshold=65536, verbose=False):
         """
         Create SGE job worker for submiting & tracking a job.
         Args:
@@ -35,14 +364,26 @@ class Proto():
           mem : per-process (thread) job memmory (Gb)
           gpu : use a gpu? (0=no, 1=yes)
           conda_env : conda env activate in the qsub job 
+          max_attempts : max number of job submissions
+          escalation_factor : time & mem are multiplied by this for each job re-submission
+            (not used if time or mem are functions)
           tmp_dir : temporary file directory
           keep_tmp : keep temporary file directory?
+          poll_base : initial delay between job status checks (seconds)
+          poll_factor : multiplicative increase of the delay per check
+          poll_cap : max delay between job status checks (seconds)
+          retry_base : initial delay before re-submitting a failed job (seconds)
+          retry_factor : multiplicative increase of the delay per attempt
+          retry_cap : max delay before re-submitting a failed job (seconds)
+          payload_inline_threshold : job parameters smaller than this (bytes) are
+            passed to the job as an argument instead of via a file
           verbose : verbose output
         """
         self.kwargs = kwargs
         self.pkgs = pkgs
         self.parallel_env=parallel_env
         self.threads = threads
+        self.escalation_factor = escalation_factor
         self.time = time
         self.mem = mem
         self.gpu = gpu
@@ -52,19 +393,17 @@ class Proto():
         self.keep_tmp = keep_tmp
         self.attempt = 1
         self.max_attempts = max_attempts
+        self.poll_base = poll_base
+        self.poll_factor = poll_factor
+        self.poll_cap = poll_cap
+        self.retry_base = retry_base
+        self.retry_factor = retry_factor
+        self.retry_cap = retry_cap
+        self.payload_inline_threshold = payload_inline_threshold
 
     @staticmethod
     def format_time(x):
-        x = str(x)
-        if re.match('^[0-9]+$', x):
-            x = int(x)
-            hours = int(x / 360)
-            minutes = int((x - (hours * 360)) / 60)
-            secs = x - (hours * 360 + minutes * 60)
-            x = '{:0>2}:{:0>2}:{:0>2}'.format(hours, minutes, secs)
-        if not re.match('^[0-9]{2}:[0-5][0-9]:[0-5][0-9]$', x):
-            raise ValueError('Time resource not formatted correctly: {}'.format(x))
-        return x
+        return _fmt_time(str(x))
         
     #-- setters --#
     @property
@@ -76,7 +415,9 @@ class Proto():
         if isinstance(x, types.FunctionType):
             self._time = x
         else:
-            self._time = lambda attempt, threads: x
+            x = _time_seconds(x)
+            f = self.escalation_factor
+            self._time = lambda attempt, threads: int(x * f ** (attempt - 1))
 
     @property
     def mem(self):
@@ -88,7 +429,8 @@ class Proto():
             self._mem = x
         else:
             x = int(str(x).rstrip('GMgm'))
-            self._mem = lambda attempt, threads: x
+            f = self.escalation_factor
+            self._mem = lambda attempt, threads: x * f ** (attempt - 1)
                           
     @property
     def tmp_dir(self):
@@ -99,30 +441,167 @@ class Proto():
             x = ''        
         y = str(uuid.uuid4()).replace('-', '')
         x = os.path.join(x, y)
-        os.makedirs(x, exist_ok=True)
-        self._tmp_dir = x   
+        # the parent dir usually exists already (eg., the Pool tmp dir)
+        try:
+            os.mkdir(x)
+        except FileNotFoundError:
+            os.makedirs(x, exist_ok=True)
+        self._tmp_dir = x
+
+    def job_python_script(self):
+        """
+        Writing python script that will run the user-provided function
+        """
+        script = '''#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import base64
+import struct
+import pickle
+import importlib
+import dill
+
+def loads(data):
+    try:
+        return pickle.loads(data)
+    except Exception:
+        return dill.loads(data)
+
+if __name__ == '__main__':
+    # load params
+    if sys.argv[1] == '--inline':
+        params = pickle.loads(base64.b64decode(sys.argv[2]))
+        outfile = sys.argv[3]
+    else:
+        with open(sys.argv[1], 'rb') as inF:
+            params = pickle.loads(inF.read())
+        outfile = sys.argv[2]
+    args, kwargs = loads(params['data'])
+    # array job: run the function on this task's element of args
+    if params.get('array', False):
+        task_id = int(os.environ['SGE_TASK_ID'])
+        args = args[task_id - 1]
+        outfile = outfile.format(task=task_id)
+    # load packages (eg., 'os.path' or 'numpy as np'), bound as globals of the user function
+    for pkg in ','.join(params['pkgs']).split(','):
+        name, _, alias = [x.strip() for x in pkg.partition(' as ')]
+        if name == '':
+            continue
+        module = importlib.import_module(name)
+        if alias != '':
+            globals()[alias] = module
+        else:
+            name = name.split('.')[0]
+            globals()[name] = sys.modules[name]
+    # run function
+    func = dill.loads(params['func'])
+    try:
+        ret = func(args, **kwargs)
+    except TypeError:
+        ret = func(**kwargs)
+    # serialize output; dill only if needed (incl. objects of __main__)
+    buffers = []
+    try:
+        if pickle.HIGHEST_PROTOCOL >= 5:
+            # large buffers (eg., numpy arrays) are kept out-of-band
+            data = pickle.dumps(ret, protocol=5, buffer_callback=buffers.append)
+        else:
+            data = pickle.dumps(ret, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        data = None
+    if data is None or b'__main__' in data:
+        buffers = []
+        data = dill.dumps(ret, protocol=pickle.HIGHEST_PROTOCOL)
+    if buffers:
+        buffers = [x.raw() for x in buffers]
+        with open(outfile + '.buf', 'wb') as outF:
+            outF.write(struct.pack('<{}Q'.format(len(buffers) + 1), len(buffers),
+                                   *[x.nbytes for x in buffers]))
+            for x in buffers:
+                outF.write(x)
+    with open(outfile, 'wb') as outF:
+        outF.write(data)
+        '''
+        self.python_script_file = os.path.join(self.tmp_dir, 'script.py')
+        with open(self.python_script_file, 'w') as outF:
+            outF.write(script)
+        if self.verbose:
+            logging.info('File written: {}'.format(self.python_script_file))
+        
+    def job_bash_script(self):
+        """
+        Write the bash script that will call the python script.
+        The job parameters & results file are provided as script arguments.
+        """
+        script = '''#!/bin/bash
+export OMP_NUM_THREADS=1
+if [[ -f ~/.bashrc &&  $(grep -c "__conda_setup=" ~/.bashrc) -gt 0 && $(grep -c "unset __conda_setup" ~/.bashrc) -gt 0 ]]; then
+   echo "Sourcing .bashrc" 1>&2
+   . ~/.bashrc
+else
+   echo "Exporting conda PATH" 1>&2
+   export PATH=/ebio/abt3_projects/software/dev/miniconda3_dev/bin:$PATH
+fi
+
+conda activate {conda_env}
+python {exe} "$@"
+        '''
+        script = script.format(conda_env = self.conda_env,
+                               exe = self.python_script_file)
+        self.bash_script_file = os.path.join(self.tmp_dir, 'script.sh')
+        with open(self.bash_script_file, 'w') as outF:
+            outF.write(script)
+        if self.verbose:
+            logging.info('File written: {}'.format(self.bash_script_file))
 
 
 class Worker(Proto):
     """
     Class to submit a cluster job, check its status, and return the results
     """    
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, poller=None, job_scripts=None, transport=None, **kwargs):
         """
         subclassing Proto
+        Args:
+          poller : QStatPoller shared among Workers (if None, qstat is called directly)
+          job_scripts : (python, bash) job script files shared among Workers
+            (if None, the job scripts are written to the Worker tmp_dir)
+          transport : TransportQueue shared among Workers for rate-limiting qsub calls
         """
         Proto.__init__(self, *args, **kwargs)
+        self.poller = poller
+        self.transport = transport
         self.param_file = None
-        self.python_script_file = None
-        self.bash_script_file = None
+        self.param_inline = None
+        self.shared_scripts = job_scripts is not None
+        if job_scripts is None:
+            job_scripts = (None, None)
+        self.python_script_file, self.bash_script_file = job_scripts
         self.results_file = None
-        self.stdout_file = None
-        self.stderr_file = None
+        self.log_file = None
         self.jobid = None
+        self.qstat_state = None
+        self.array = False
+        self.n_tasks = 1
         # checking that SGE commands exist
-        for exe in ['qsub', 'qstat', 'qacct']:
-            if find_executable(exe) is None:
-                raise OSError('Cannot find command: {}'.format(exe))            
+        _check_sge_tools()
+
+    def reset(self):
+        """
+        Resetting the per-job state (& tmp dir) so the Worker can run another job
+        """
+        self.attempt = 1
+        self.param_file = None
+        self.param_inline = None
+        self.results_file = None
+        self.log_file = None
+        self.jobid = None
+        self.qstat_state = None
+        if not self.shared_scripts:
+            self.python_script_file = None
+            self.bash_script_file = None
+        self.tmp_dir = os.path.dirname(self.tmp_dir)
 
     def _run(self, func, args):
         """
@@ -131,12 +610,32 @@ class Worker(Proto):
         # serialize
         self.serialize(func, args, self.kwargs, self.pkgs)
         # job script
-        self.job_python_script()
-        self.job_bash_script()
+        if self.bash_script_file is None:
+            self.job_python_script()
+            self.job_bash_script()
         # qsub
+        if self.poller is not None and self.poller.stopped:
+            raise RuntimeError('qstat poller stopped; not submitting job')
         self.qsub()
         # check job
-        return self.check_job()
+        if self.poller is not None:
+            try:
+                self.poller.register(self.jobid)
+            except RuntimeError:
+                # the Pool is shutting down; do not leave the job on the cluster
+                self.qdel()
+                raise
+        try:
+            return self.check_job()
+        except BaseException:
+            # interrupted (eg., Ctrl-C); remove the job from the queue.
+            # A stopped poller means the Pool is shutting down & deletes its jobs itself.
+            if self.poller is None or not self.poller.stopped:
+                self.qdel()
+            raise
+        finally:
+            if self.poller is not None:
+                self.poller.unregister(self.jobid)
                     
     def __call__(self, func, args=[]):
         """
@@ -149,28 +648,43 @@ class Worker(Proto):
             ## fail
             if ret == 'failed':
                 if self.attempt >= self.max_attempts:
-                    self.write_job_log('stderr.txt')
-                    self.write_job_log('stdout.txt')
+                    self.write_job_log('log.txt')
                     self.clean_up()
                     raise ValueError('job failed: {}'.format(self.jobid))                
                 else:
+                    # back off before re-submitting with escalated resources
+                    self.sleep(min(self.retry_cap, self.retry_base * self.retry_factor ** self.attempt))
                     self.attempt += 1
                     continue
             ## success
             elif ret == 'success':
-                ret = pickle.load(open(self.results_file, 'rb'))
+                ret = self.load_results()
             # clean up
             self.clean_up()
             return ret            
 
-    def write_job_log(self, log_file='stderr.txt'):
+    def load_results(self):
+        """
+        Loading the serialized function output
+        """
+        return _load(self.results_file)
+
+    def write_job_log(self, log_file='log.txt'):
+        """
+        Writing the job log (stdout & stderr) to stderr
+        """
         sys.stderr.write('#------ {} ------#\n'.format(log_file))
         F = os.path.join(self.tmp_dir, log_file)
         if os.path.isfile(F):
-            with open(F) as inF:
-                for line in inF:
-                    sys.stderr.write(line)
-        sys.stderr.write('#------------------------#\n'.format(log_file))        
+            with open(F, 'rb', buffering=1 << 16) as inF:
+                outF = getattr(sys.stderr, 'buffer', None)
+                if outF is None:
+                    sys.stderr.write(inF.read().decode(errors='replace'))
+                else:
+                    sys.stderr.flush()
+                    shutil.copyfileobj(inF, outF, 1 << 16)
+                    outF.flush()
+        sys.stderr.write('#------------------------#\n')
         
     def clean_up(self):
         """
@@ -178,214 +692,295 @@ class Worker(Proto):
         """
         if self.keep_tmp is True:
             return None
-        if os.path.isdir(self.tmp_dir):
-            try:
-                shutil.rmtree(self.tmp_dir)
-            except OSError:
-                time.sleep(5)
-                try:
-                    shutil.rmtree(self.tmp_dir)
-                except OSError:
-                    logging.warning('Could not remove tmp dir: {}'.format(self.tmp_dir))
-        if self.verbose and not os.path.isdir(self.tmp_dir):
-            logging.info('tmp dir removed: {}'.format(self.tmp_dir))
+        # removed in the background; the job results have already been loaded
+        _cleanup_pool().submit(_rmtree_robust, self.tmp_dir, self.verbose)
 
     def check_job(self):
         """
         Check the status of the SGE job 
         """
-        regex = re.compile(r' +')
-        delay = 2
+        n_checks = 0
+        prev_state = None
         while(1):
-            # time delay between checks
-            time.sleep(delay)
-            delay = 60 if delay > 60 else delay * 1.2
+            # time delay between checks (truncated exponential backoff + jitter)
+            delay = min(self.poll_cap, self.poll_base * self.poll_factor ** n_checks)
+            self.sleep(delay + random.uniform(0, 0.3 * delay))
+            if delay < self.poll_cap:
+                n_checks += 1
             # qstat
-            ret = self.qstat_check(regex)
-            if ret is None:
-                time.sleep(5)
-            elif ret == 'failed':
-                sys.stderr('job faild: {}'.format(self.jobid))
+            ret = self.qstat_check()
+            ## job state changed (eg., qw -> r); reset the backoff
+            if self.qstat_state != prev_state:
+                n_checks = 0
+            prev_state = self.qstat_state
+            if ret == 'failed':
+                # terminal qstat state (Eqw/d); no need to check qacct
+                logging.warning('job failed: {}'.format(self.jobid))
+                ## Eqw jobs stay queued; remove so they cannot run alongside a re-submission
+                if self.qstat_state == b'Eqw':
+                    self.qdel()
+                return ret
             elif ret == 'running':
                 continue
-            # qacct 
-            ret = self.qacct_check(regex)
+            # job no longer listed by qstat; qacct has the exit status
+            self.sleep(5)
+            ret = self.qacct_check()
             if ret is None:
                 continue
             else:
                 return ret
             
-    def qstat_check(self, regex):
+    def qstat_check(self):
         """
-        Check job status via qstat
+        Check job status via qstat; the raw qstat state is kept in self.qstat_state
         """
         if self.verbose:
-            logging.info('qstat check: {}'.format(self.jobid))                  
-        p = sp.Popen(['qstat'], stdout=sp.PIPE)
-        output, err = p.communicate()
-        if p.returncode != 0:
-            return None
-        for x in output.decode().split('\n'):
-            y = re.split(regex, x)
-            if y[0] == self.jobid:
-                if y[4] in ['r', 'qw', 't']:
-                    return 'running'
-                elif y[4] in ['Eqw', 'd']:
-                    return 'failed'
-                else:
-                    return 'running'
-        return None
+            logging.info('qstat check: {}'.format(self.jobid))
+        if self.poller is not None:
+            self.qstat_state = self.poller.get(self.jobid)
+        else:
+            p = sp.run(['qstat'], stdout=sp.PIPE)
+            if p.returncode != 0:
+                self.qstat_state = None
+            else:
+                self.qstat_state = _parse_qstat(p.stdout).get(self.jobid.encode())
+        return _qstat_status(self.qstat_state)
+
+    def sleep(self, seconds):
+        """
+        Sleep between job checks; returns early if the poller is stopped
+        """
+        if self.poller is not None:
+            self.poller.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def qdel(self):
+        """
+        Delete the job from the queue
+        """
+        _qdel(self.jobid, self.verbose)
 
-    def qacct_check(self, regex):
+    def qacct_check(self):
         """
         Check job status via qacct
         """
         if self.verbose:
-            logging.info('qacct check: {}'.format(self.jobid))                           
-        cmd = 'qacct -j {jobid}'.format(jobid=self.jobid)
-        p = sp.Popen([cmd], stdout=sp.PIPE, shell=True, stderr=sp.DEVNULL)
-        output, err = p.communicate()
+            logging.info('qacct check: {}'.format(self.jobid))
+        p = sp.run(['qacct', '-j', str(self.jobid)], stdout=sp.PIPE,
+                   stderr=sp.DEVNULL, check=False)
         if p.returncode != 0:
             return None
-        for x in output.decode().split('\n'):
-            x = regex.split(x)
-            if x[0] == 'exit_status':
-                if x[1] == '0':
-                    return 'success'
-                else:
-                    return 'failed'
-        return None
+        exit_status = _QACCT_EXIT.findall(p.stdout)
+        # all tasks of the job must be finished
+        if len(exit_status) < self.n_tasks:
+            return None
+        if all([x == b'0' for x in exit_status]):
+            return 'success'
+        return 'failed'
                 
-    def qsub(self):
+    def job_files(self):
         """
-        formatting qsub command
+        Setting the job log & results file paths
         """
-        self.stdout_file = os.path.join(self.tmp_dir, 'stdout.txt')
-        self.stderr_file = os.path.join(self.tmp_dir, 'stderr.txt')
-        cmd = 'qsub -cwd -pe {par_env} {threads} -l h_vmem={mem} -l h_rt={time}'
-        cmd += ' -l gpu={gpu} -o {std_out} -e {std_err} {job_script}'
-        cmd = cmd.format(par_env=self.parallel_env,
-                         threads=self.threads,
-                         mem=self.mem,
-                         time=self.time,
-                         gpu=self.gpu,
-                         std_out=self.stdout_file,
-                         std_err=self.stderr_file,
-                         job_script=self.bash_script_file)
-        if self.verbose:
-            logging.info('CMD: {}'.format(cmd))
-        try:
-            res = sp.run(cmd, check=True, shell=True, stdout=sp.PIPE)
-        except sp.CalledProcessError as e:
-            raise e
-        res = res.stdout.decode()
-        try:
-            m = re.search("Your job ([0-9]+)", res)
-            self.jobid = m.group(1)            
-        except Exception as e:
-            raise ValueError(e)
-        
-    def job_python_script(self):
+        self.log_file = os.path.join(self.tmp_dir, 'log.txt')
+        self.results_file = os.path.join(self.tmp_dir, 'results.pkl')
+
+    def qsub_opts(self):
         """
-        Writing python script that will run the user-provided function
+        Additional qsub options
         """
-        if self.attempt > 1:
-            return None
-        script = '''#!/usr/bin/env python
-from __future__ import print_function
-import os
-import sys
-import dill as pickle
-
-if __name__ == '__main__':
-    # load params
-    with open(sys.argv[1], 'rb') as inF:
-        params = pickle.load(inF)
-    # load packages
-    for pkg in params['pkgs']:
-        exec('import {}'.format(pkg))
-    # run function & serialize output
-    with open(sys.argv[2], 'wb') as outF:
-        try:
-            pickle.dump(params['func'](params['args'], **params['kwargs']), outF)
-        except TypeError:
-            pickle.dump(params['func'](**params['kwargs']), outF)
-        '''
-        self.python_script_file = os.path.join(self.tmp_dir, 'script.py')
-        with open(self.python_script_file, 'w') as outF:
-            outF.write(script)
-        if self.verbose:
-            logging.info('File written: {}'.format(self.python_script_file))
+        return []
         
-    def job_bash_script(self):
-        """        
-        Write the bash script that will call the python script
+    def qsub(self):
         """
-        if self.attempt > 1:
-            return None
-        script = '''#!/bin/bash
-export OMP_NUM_THREADS=1
-if [[ -f ~/.bashrc &&  $(grep -c "__conda_setup=" ~/.bashrc) -gt 0 && $(grep -c "unset __conda_setup" ~/.bashrc) -gt 0 ]]; then
-   echo "Sourcing .bashrc" 1>&2
-   . ~/.bashrc
-else
-   echo "Exporting conda PATH" 1>&2
-   export PATH=/ebio/abt3_projects/software/dev/miniconda3_dev/bin:$PATH
-fi
-
-conda activate {conda_env}
-python {exe} {params} {outfile}
-        '''
-        self.results_file = os.path.join(self.tmp_dir, 'results.pkl')
-        script = script.format(conda_env = self.conda_env,
-                               exe = self.python_script_file,
-                               params = self.param_file,
-                               outfile = self.results_file)
-        self.bash_script_file = os.path.join(self.tmp_dir, 'script.sh')
-        with open(self.bash_script_file, 'w') as outF:
-            outF.write(script)
+        formatting qsub command
+        """
+        self.job_files()
+        if self.param_inline is not None:
+            params = ['--inline', self.param_inline]
+        else:
+            params = [self.param_file]
+        cmd = ['qsub', '-cwd', '-pe', self.parallel_env, str(self.threads),
+               '-l', 'h_vmem={}'.format(self.mem), '-l', 'h_rt={}'.format(self.time),
+               '-l', 'gpu={}'.format(self.gpu)]
+        cmd += self.qsub_opts()
+        cmd += ['-j', 'y', '-o', self.log_file, self.bash_script_file]
+        cmd += params + [self.results_file]
         if self.verbose:
-            logging.info('File written: {}'.format(self.bash_script_file))
-            
+            logging.info('CMD: {}'.format(' '.join(cmd)))
+        if self.transport is not None:
+            with self.transport:
+                res = sp.run(cmd, check=True, stdout=sp.PIPE)
+        else:
+            res = sp.run(cmd, check=True, stdout=sp.PIPE)
+        m = _QSUB_JOBID.search(res.stdout)
+        if m is None:
+            raise ValueError('Cannot parse job id from qsub output: {}'.format(res.stdout))
+        self.jobid = m.group(1).decode()
+        
     def serialize(self, func, args=None, kwargs=dict(), pkgs=[]):
         """
         Serializing all python script parameter objects
         """
         if self.attempt > 1:
             return None
-        d = {'func' : func, 'args' : args, 'kwargs' : kwargs, 'pkgs' : pkgs}
+        # only the function requires dill; args/kwargs get their own blob,
+        # so that the function's __main__ refs do not force dill for them too
+        d = {'func' : dill.dumps(func, protocol=pickle.HIGHEST_PROTOCOL),
+             'data' : _dumps((args, kwargs)),
+             'pkgs' : pkgs, 'array' : self.array}
+        d = pickle.dumps(d, protocol=pickle.HIGHEST_PROTOCOL)
+        # small payloads are passed to the job directly (no file I/O)
+        if len(d) < self.payload_inline_threshold:
+            self.param_inline = base64.b64encode(d).decode()
+            return None
         outfile = os.path.join(self.tmp_dir, 'job_params.pkl')
         with open(outfile, 'wb') as outF:
-            pickle.dump(d, outF)
+            outF.write(d)
         self.param_file = outfile
         if self.verbose:
             logging.info('File written: {}'.format(outfile))
         
+class ArrayWorker(Worker):
+    """
+    Class to run a function on all elements of an iterable as a single SGE array job
+    """
+    def __init__(self, *args, max_tasks=None, **kwargs):
+        """
+        subclassing Worker
+        Args:
+          max_tasks : max number of array tasks running concurrently (qsub -tc)
+        """
+        Worker.__init__(self, *args, **kwargs)
+        self.array = True
+        self.max_tasks = max_tasks
+
+    def serialize(self, func, args=None, kwargs=dict(), pkgs=[]):
+        """
+        Serializing all python script parameter objects; one array task per element of args
+        """
+        args = list(args)
+        self.n_tasks = len(args)
+        Worker.serialize(self, func, args, kwargs, pkgs)
+
+    def job_files(self):
+        """
+        Setting the per-task job log & results file paths
+        """
+        self.log_file = os.path.join(self.tmp_dir, 'log.$TASK_ID.txt')
+        self.results_file = os.path.join(self.tmp_dir, 'results_{task}.pkl')
+
+    def qsub_opts(self):
+        """
+        qsub array job options
+        """
+        opts = ['-t', '1-{}'.format(self.n_tasks)]
+        if self.max_tasks is not None:
+            opts += ['-tc', str(self.max_tasks)]
+        return opts
+
+    def load_results(self):
+        """
+        Loading the serialized function output of each task (in task order)
+        """
+        ret = []
+        for i in range(1, self.n_tasks + 1):
+            F = self.results_file.format(task=i)
+            ret.append(_load(F))
+        return ret
+
+    def write_job_log(self, log_file='log.txt'):
+        """
+        Writing the job log of each task lacking a results file
+        """
+        for i in range(1, self.n_tasks + 1):
+            if not os.path.isfile(self.results_file.format(task=i)):
+                x = log_file.split('.')
+                Worker.write_job_log(self, '{}.{}.{}'.format(x[0], i, x[1]))
+
+        
 class Pool(Proto):
-    def __init__(self, n_jobs=1, *args, **kwargs):
+    def __init__(self, n_jobs=1, *args, qsub_min_interval=0.2, qsub_max_inflight=4, **kwargs):
         """
         subclassing Proto class
+        Args:
+          n_jobs : number of parallel workers
+          qsub_min_interval : min time between job submissions (seconds)
+          qsub_max_inflight : max number of concurrent job submissions
         """
         super().__init__(*args, **kwargs)
         self.n_jobs = n_jobs
+        self.transport = TransportQueue(min_interval=qsub_min_interval,
+                                        max_inflight=qsub_max_inflight)
+        # job scripts are written once per map call & shared by all workers
+        self.python_script_file = None
+        self.bash_script_file = None
+        # one (reused) worker per pool thread
+        self._local = threading.local()
+
+    def set_up(self):
+        """
+        Writing the job scripts shared by all workers into the pool tmp dir
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.job_python_script()
+        self.job_bash_script()
+
+    def clean_up(self):
+        """
+        Remove the pool temp directory (job scripts & any remaining worker tmp dirs)
+        """
+        if self.keep_tmp is True:
+            return None
+        # worker tmp dirs may still be being removed in the background
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        if os.path.isdir(self.tmp_dir):
+            _pending_cleanup.append(self.tmp_dir)
+        elif self.verbose:
+            logging.info('tmp dir removed: {}'.format(self.tmp_dir))
 
-    def run_worker(self, args, func):
+    def run_worker(self, args, func, poller=None):
         """
-        Creating worker object & running
+        Running the job via the pool thread's worker object (created if needed)
         """
-        w = Worker(kwargs = self.kwargs,
+        w = getattr(self._local, 'worker', None)
+        if w is not None and w.poller is poller:
+            w.reset()
+            return w(func, args)
+        w = Worker(poller = poller,
+                   transport = self.transport,
+                   job_scripts = (self.python_script_file, self.bash_script_file),
+                   kwargs = self.kwargs,
                    pkgs = self.pkgs,
                    parallel_env = self.parallel_env,
                    threads = self.threads,
-                   time = self.time,
-                   mem = self.mem,
+                   time = self._time,
+                   mem = self._mem,
                    gpu = self.gpu,
                    tmp_dir = self.tmp_dir,
                    conda_env = self.conda_env,
+                   max_attempts = self.max_attempts,
+                   escalation_factor = self.escalation_factor,
                    verbose = self.verbose,
-                   keep_tmp = self.keep_tmp)                   
+                   keep_tmp = self.keep_tmp,
+                   poll_base = self.poll_base,
+                   poll_factor = self.poll_factor,
+                   poll_cap = self.poll_cap,
+                   retry_base = self.retry_base,
+                   retry_factor = self.retry_factor,
+                   retry_cap = self.retry_cap,
+                   payload_inline_threshold = self.payload_inline_threshold)
+        self._local.worker = w
         return w(func, args)
         
+    @staticmethod
+    def run_worker_indexed(x, F):
+        """
+        Running F on an (index, args) tuple; returns (index, result)
+        """
+        return x[0], F(x[1])
+
     def map(self, func, args):
         """
         map function wrapper for python map or multiprocessing.map
@@ -393,14 +988,65 @@ class Pool(Proto):
           func : function to map
           args : iterable which function is applied to
         """
-        F = functools.partial(self.run_worker, func=func)
-        if self.n_jobs > 1:
-            with mp.Pool(self.n_jobs) as p:
-                if self.verbose is False:
-                    return list(tqdm.tqdm(p.imap(F, args), total=len(args)))
-                else:
-                    return list(p.map(F, args))
-        else:
-            return list(tqdm.tqdm(map(F, args), total=len(args)))
-            
-        
+        self.set_up()
+        poller = QStatPoller(verbose=self.verbose)
+        poller.start()
+        F = functools.partial(self.run_worker, func=func, poller=poller)
+        try:
+            if self.n_jobs > 1:
+                # workers only wait on SGE, so threads suffice & can share the poller
+                with ThreadPool(self.n_jobs) as p:
+                    if self.verbose is False:
+                        # unordered, so the progress bar is not held up by slow jobs
+                        G = functools.partial(self.run_worker_indexed, F=F)
+                        ret = tqdm.tqdm(p.imap_unordered(G, enumerate(args)), total=len(args))
+                        return [x[1] for x in sorted(ret, key=lambda x: x[0])]
+                    else:
+                        return list(p.map(F, args))
+            else:
+                return list(tqdm.tqdm(map(F, args), total=len(args)))
+        finally:
+            # worker threads return once the poller stops; delete any jobs still on the cluster
+            for jobid in poller.stop():
+                _qdel(jobid, self.verbose)
+            self.clean_up()
+
+    def map_array(self, func, args):
+        """
+        map function wrapper that submits a single SGE array job (one task per element of args)
+        Args:
+          func : function to map
+          args : iterable which function is applied to
+        """
+        args = list(args)
+        # no tasks to submit (qsub -t 1-0 is invalid)
+        if len(args) == 0:
+            return []
+        self.set_up()
+        w = ArrayWorker(max_tasks = self.n_jobs,
+                        transport = self.transport,
+                        job_scripts = (self.python_script_file, self.bash_script_file),
+                        kwargs = self.kwargs,
+                        pkgs = self.pkgs,
+                        parallel_env = self.parallel_env,
+                        threads = self.threads,
+                        time = self._time,
+                        mem = self._mem,
+                        gpu = self.gpu,
+                        tmp_dir = self.tmp_dir,
+                        conda_env = self.conda_env,
+                        verbose = self.verbose,
+                        keep_tmp = self.keep_tmp,
+                        max_attempts = self.max_attempts,
+                        escalation_factor = self.escalation_factor,
+                        poll_base = self.poll_base,
+                        poll_factor = self.poll_factor,
+                        poll_cap = self.poll_cap,
+                        retry_base = self.retry_base,
+                        retry_factor = self.retry_factor,
+                        retry_cap = self.retry_cap,
+                        payload_inline_threshold = self.payload_inline_threshold)
+        try:
+            return w(func, args)
+        finally:
+            self.clean_up()
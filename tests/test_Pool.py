@@ -15,3 +15,9 @@ def test_pool():
     test of pooling function
     """
     subprocess.run(['sgepy-test.py', '--test', 'pool'])
+
+def test_array():
+    """
+    test of pooling via an array job
+    """
+    subprocess.run(['sgepy-test.py', '--test', 'array'])
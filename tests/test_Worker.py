@@ -42,3 +42,49 @@ def test_error():
     test job error 
     """
     subprocess.run(['sgepy-test.py', '--test', 'error'])
+
+def test_format_time():
+    """
+    time resource formatting (no SGE required)
+    """
+    assert SGE.Proto.format_time(3600) == '01:00:00'
+    assert SGE.Proto.format_time(360000) == '100:00:00'
+    assert SGE.Proto.format_time('00:59:00') == '00:59:00'
+    with pytest.raises(ValueError):
+        SGE.Proto.format_time('1:00')
+
+def test_parse_qstat():
+    """
+    parsing qstat output (no SGE required)
+    """
+    out = b'''job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID
+-----------------------------------------------------------------------------------------------------------------
+ 123456 0.50000 script.sh  nyoungblut   r     10/15/2020 10:00:00 all.q@node1                        1
+ 123457 0.00000 script.sh  nyoungblut   qw    10/15/2020 10:00:05                                    1 1-3:1
+ 123458 0.00000 script.sh  nyoungblut   Eqw   10/15/2020 10:00:09                                    1
+'''
+    states = SGE._parse_qstat(out)
+    assert states == {b'123456' : b'r', b'123457' : b'qw', b'123458' : b'Eqw'}
+    assert SGE._qstat_status(states.get(b'123456')) == 'running'
+    assert SGE._qstat_status(states.get(b'123458')) == 'failed'
+    assert SGE._qstat_status(states.get(b'1')) is None
+    assert SGE._parse_qstat(b'') == {}
+
+def test_qacct_exit():
+    """
+    parsing qacct exit status (no SGE required)
+    """
+    out = b'''==============================================================
+qname        all.q
+jobnumber    123456
+taskid       1
+failed       0
+exit_status  0
+==============================================================
+qname        all.q
+jobnumber    123456
+taskid       2
+failed       0
+exit_status  137                  (Killed)
+'''
+    assert SGE._QACCT_EXIT.findall(out) == [b'0', b'137']